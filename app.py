@@ -222,7 +222,7 @@ def main():
                 is_cumulative = 'ACC' in selected_param.upper()
                 if is_cumulative: base_df = processing.calculate_interval_data(base_df)
                 df_filtered = processing.filter_data_by_time(base_df, time_window_option, st.session_state.get("custom_start"), st.session_state.get("custom_end"))
-                df_annotated = processing.add_light_dark_cycle_info(df_filtered, light_start, light_end)
+                df_annotated = processing.add_light_dark_cycle_info(df_filtered, light_start, light_end, st.session_state.get("_light_mask"))
                 df_flagged = processing.flag_outliers(df_annotated, sd_threshold)
                 df_processed = processing.add_group_info(df_flagged, st.session_state.get('group_assignments', {}))
             
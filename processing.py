@@ -2,16 +2,27 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+import codecs
 import io
 import re
 from datetime import timedelta
 
 
-def parse_clams_header(lines):
+def _detect_delimiter(head_text):
+    """Picks the file's delimiter (tab or comma) from the first few KB of its text."""
+    sample = head_text[:4096]
+    return '\t' if sample.count('\t') > sample.count(',') else ','
+
+
+def parse_clams_header(lines, delimiter=','):
     """
-    Parses the header of a CLAMS data file from a list of strings to extract metadata.
-    This version is robust to both comma and tab delimiters in the header.
+    Parses the header of a CLAMS data file from an iterable of lines to extract metadata.
+
+    The delimiter is detected once per file (see _detect_delimiter) rather than per
+    line; the other delimiter is only tried for lines that lack the detected one.
     """
+    other_delimiter = ',' if delimiter == '\t' else '\t'
     parameter = None
     animal_ids = {}
     data_start_line = -1
@@ -27,10 +38,10 @@ def parse_clams_header(lines):
             data_start_line = i
             break
 
-        if ',' in clean_line:
-            parts = [p.strip() for p in clean_line.split(',', 1)]
-        elif '\t' in clean_line:
-            parts = [p.strip() for p in clean_line.split('\t', 1)]
+        if delimiter in clean_line:
+            parts = [p.strip() for p in clean_line.split(delimiter, 1)]
+        elif other_delimiter in clean_line:
+            parts = [p.strip() for p in clean_line.split(other_delimiter, 1)]
         else:
             parts = [clean_line]
 
@@ -67,101 +78,264 @@ def parse_clams_header(lines):
     return parameter, animal_ids, data_start_line
 
 
-def parse_clams_data(lines, data_start_line, animal_ids):
+def read_clams_header(data_file, chunk_size=65536):
+    """
+    Reads just the header region of an uploaded CLAMS file and parses it.
+
+    The file is read in chunks only until the ':DATA' marker is found, so the
+    (much larger) data section is never decoded here.
+
+    Args:
+        data_file: A binary file-like object (e.g. a Streamlit UploadedFile).
+        chunk_size (int): Number of bytes to read per chunk.
+
+    Returns:
+        tuple: (parameter, animal_ids, data_offset), where data_offset is the byte
+               offset of the ':DATA' marker, or (None, None, -1) if there is none.
+    """
+    data_file.seek(0)
+    header_bytes = bytearray()
+    search_from = 0
+    data_offset = -1
+    while data_offset == -1:
+        chunk = data_file.read(chunk_size)
+        if not chunk:
+            break
+        header_bytes.extend(chunk)
+        data_offset = header_bytes.find(b':DATA', search_from)
+        # The marker may straddle two chunks, so re-check the tail of this one next time
+        search_from = max(0, len(header_bytes) - len(b':DATA') + 1)
+
+    # Not a CLAMS data file (e.g. an unrelated CSV from the same folder): reject it
+    # on the raw-byte search alone, without decoding anything.
+    if data_offset == -1:
+        return None, None, -1
+
+    delimiter = _detect_delimiter(header_bytes[:4096].decode('utf-8', errors='ignore'))
+    # Decode lazily, line by line: parse_clams_header stops at the :DATA line, so any
+    # data rows that came in with the last chunk are never decoded.
+    header_lines = io.TextIOWrapper(io.BytesIO(header_bytes), encoding='utf-8', errors='ignore')
+    parameter, animal_ids, data_start_line = parse_clams_header(header_lines, delimiter)
+    if data_start_line == -1:
+        return None, None, -1
+
+    return parameter, animal_ids, data_offset
+
+
+def _dedupe_column_names(columns):
+    """
+    Renames repeated column names the way the pandas C parser does
+    ('TIME', 'TIME.1', 'TIME.2', ...). The pyarrow reader keeps duplicates as-is.
+    """
+    seen = {}
+    deduped = []
+    for col in columns:
+        if col in seen:
+            seen[col] += 1
+            deduped.append(f"{col}.{seen[col]}")
+        else:
+            seen[col] = 0
+            deduped.append(col)
+    return deduped
+
+
+def _is_utf8(data_file, chunk_size=1 << 20):
+    """
+    Returns True if everything from data_file's current position decodes as UTF-8.
+    Reads in chunks and leaves the stream position where it was.
+    """
+    start = data_file.tell()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for chunk in iter(lambda: data_file.read(chunk_size), b''):
+            decoder.decode(chunk)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    finally:
+        data_file.seek(start)
+    return True
+
+
+def _is_data_row(text, separator):
+    """Returns True if a raw data-table row starts with a numeric INTERVAL field."""
+    try:
+        float(text.split(separator, 1)[0])
+    except ValueError:
+        return False
+    return True
+
+
+def parse_clams_data(data_file, data_offset, animal_ids, engine='c'):
     """
-    Parses the data section of a CLAMS file from a list of strings into a tidy DataFrame.
+    Parses the data section of a CLAMS file into a tidy DataFrame.
     This version auto-detects the delimiter and handles multiple timestamp formats.
-    
+
+    The data table is streamed straight from the file handle into pandas rather
+    than being joined into one large in-memory string first.
+
     Args:
-        lines (list): The content of the file as a list of strings.
-        data_start_line (int): The line number where the data starts.
+        data_file: A binary file-like object (e.g. a Streamlit UploadedFile).
+        data_offset (int): Byte offset of the ':DATA' marker as returned by
+                           read_clams_header, or -1 if absent.
         animal_ids (dict): A mapping from CAGE names to Subject IDs.
+        engine (str): 'c' (default) or 'pyarrow'. 'pyarrow' tries the faster
+                      multi-threaded reader first and re-reads the file with the
+                      C parser in the cases where the two are known to differ:
+                      - pyarrow is unavailable or rejects the file;
+                      - the data section is not valid UTF-8 (pyarrow can't skip
+                        undecodable bytes the way encoding_errors='ignore' does);
+                      - a data row has fewer fields than the header (the C parser
+                        pads it with NaN and keeps its readings; pyarrow drops it).
+
+    Returns:
+        tuple: (df_tidy, error_message). Errors are returned rather than shown with
+               st.error so the parser can run off the main script thread.
     """
-    if data_start_line == -1:
-        st.error("Cannot parse data because ':DATA' marker was not found.")
-        return None
+    if data_offset == -1:
+        return None, "Cannot parse data because ':DATA' marker was not found."
 
     try:
-        header_line_index = -1
+        # Jump straight to the :DATA marker and skip the rest of its line.
+        data_file.seek(data_offset)
+        data_file.readline()
+
+        header_offset = -1
         header_line_str = ""
         # Find the actual header line by skipping blank lines and decorators after :DATA
-        for i, line in enumerate(lines[data_start_line + 1:]):
-            clean_line = line.strip()
+        while True:
+            offset = data_file.tell()
+            raw_line = data_file.readline()
+            if not raw_line:
+                break
+            clean_line = raw_line.decode('utf-8', errors='ignore').strip()
             if clean_line and not clean_line.startswith('==='):
-                header_line_index = data_start_line + 1 + i
+                header_offset = offset
                 header_line_str = clean_line
                 break
-        
-        if header_line_index == -1:
-            st.error("Could not find the 'INTERVAL' data header row after the :DATA marker.")
-            return None
+
+        if header_offset == -1:
+            return None, "Could not find the 'INTERVAL' data header row after the :DATA marker."
 
         # --- FIX 1: DYNAMIC DELIMITER DETECTION ---
         separator = ',' if header_line_str.count(',') > header_line_str.count('\t') else '\t'
 
-        # Join the relevant lines into a single string for pandas, starting from the true header
-        data_as_string = "\n".join(lines[header_line_index:])
-        
-        df_wide = pd.read_csv(
-            io.StringIO(data_as_string),
-            sep=separator,
-            on_bad_lines='skip',
-            low_memory=False,
-            # This is crucial for comma-separated files with spaces like the example
-            skipinitialspace=True if separator == ',' else False 
-        )
+        # Rewind to the true header and let pandas stream the rest of the file
+        data_file.seek(header_offset)
+        read_options = dict(sep=separator, on_bad_lines='skip', encoding_errors='ignore')
+
+        df_wide = None
+        # pyarrow would drop rows with stray invalid bytes instead of ignoring the bytes
+        if engine == 'pyarrow' and _is_utf8(data_file):
+            short_data_rows = []
+
+            def skip_bad_row(row):
+                # pyarrow can only skip a ragged row. A short one that starts with an
+                # INTERVAL number still holds readings the C parser would keep.
+                if row.actual_columns < row.expected_columns and _is_data_row(row.text, separator):
+                    short_data_rows.append(row.number)
+                return 'skip'
+
+            try:
+                # Multi-threaded tokenizer; much faster on wide files with many cages
+                df_wide = pd.read_csv(data_file, engine='pyarrow', **dict(read_options, on_bad_lines=skip_bad_row))
+            except (ImportError, ValueError):
+                # pyarrow is not installed or rejected this file
+                pass
+            if df_wide is None or short_data_rows:
+                # Re-read the table with the C parser instead
+                df_wide = None
+                data_file.seek(header_offset)
+
+        if df_wide is None:
+            df_wide = pd.read_csv(
+                data_file,
+                engine='c',
+                low_memory=False,
+                # This is crucial for comma-separated files with spaces like the example
+                skipinitialspace=True if separator == ',' else False,
+                **read_options
+            )
 
     except Exception as e:
-        st.error(f"Error reading the data section with Pandas: {e}")
-        return None
+        return None, f"Error reading the data section with Pandas: {e}"
 
     # Clean column names by stripping whitespace
-    df_wide.columns = [str(col).strip() for col in df_wide.columns]
+    df_wide.columns = _dedupe_column_names(str(col).strip() for col in df_wide.columns)
 
     if 'INTERVAL' not in df_wide.columns:
-        st.error(f"Parsing failed: 'INTERVAL' column not found. Detected separator as '{separator}'. Check file format.")
-        return None
-    
-    df_wide['INTERVAL'] = pd.to_numeric(df_wide['INTERVAL'], errors='coerce')
-    df_wide.dropna(subset=['INTERVAL'], inplace=True)
-
-    all_animals_data = []
-    cage_columns = [col for col in df_wide.columns if col.upper().startswith('CAGE')]
+        return None, f"Parsing failed: 'INTERVAL' column not found. Detected separator as '{separator}'. Check file format."
     
-    for i, cage_col_name in enumerate(cage_columns):
+    # Clean files already come back with a numeric INTERVAL column; only coerce
+    # (and drop the resulting NaN rows) when junk rows forced it to strings.
+    if not pd.api.types.is_numeric_dtype(df_wide['INTERVAL']):
+        df_wide['INTERVAL'] = pd.to_numeric(df_wide['INTERVAL'], errors='coerce')
+    if df_wide['INTERVAL'].isna().any():
+        df_wide = df_wide[df_wide['INTERVAL'].notna()]
+
+    # Locate every CAGE column and its matching TIME column once, by position.
+    columns = df_wide.columns
+    cage_positions = np.flatnonzero(columns.str.upper().str.startswith('CAGE'))
+    time_positions, value_positions = [], []
+    for i, cage_pos in enumerate(cage_positions):
         time_col_name = 'TIME' if i == 0 else f'TIME.{i}'
-        
-        if time_col_name in df_wide.columns and cage_col_name in df_wide.columns:
-            temp_df = df_wide[[time_col_name, cage_col_name]].copy()
-            temp_df.columns = ['timestamp', 'value']
-            
-            subject_id = animal_ids.get(cage_col_name, cage_col_name)
-            temp_df['animal_id'] = subject_id
-            all_animals_data.append(temp_df)
+        if time_col_name in columns:
+            time_positions.append(columns.get_loc(time_col_name))
+            value_positions.append(cage_pos)
 
-    if not all_animals_data:
-        st.error("Could not extract any animal data columns. Check the file's data table format.")
-        return None
+    if not value_positions:
+        return None, "Could not extract any animal data columns. Check the file's data table format."
+
+    # Pre-allocate the tidy columns and write each cage into its own block of
+    # rows, instead of copying a small frame per cage and concatenating them.
+    n_rows = len(df_wide)
+    n_cages = len(value_positions)
+    values = np.empty(n_rows * n_cages, dtype=np.float64)
+
+    # A handful of animals repeated over every row: store as categorical codes.
+    subject_ids = [animal_ids.get(columns[pos], columns[pos]) for pos in value_positions]
+    categories, cage_codes = np.unique(subject_ids, return_inverse=True)
+
+    # Lay the cages out in animal_id order; each cage is already chronological,
+    # so the tidy frame comes out sorted by (animal_id, timestamp) as built.
+    cage_order = np.argsort(cage_codes, kind='stable')
+    codes = np.repeat(cage_codes[cage_order].astype(np.int32), n_rows)
+
+    for i, cage in enumerate(cage_order):
+        rows = slice(i * n_rows, (i + 1) * n_rows)
+        values[rows] = pd.to_numeric(df_wide.iloc[:, value_positions[cage]], errors='coerce')
 
-    df_tidy = pd.concat(all_animals_data, ignore_index=True)
-    df_tidy.dropna(subset=['timestamp', 'value'], inplace=True)
-    
     # --- FIX 2: ROBUST TIMESTAMP PARSING ---
     # Explicitly set dayfirst=True to handle dd/mm/yyyy format common in non-US locales.
     # This prevents misinterpreting dates like '13/09/2024' and solves the "spiderweb" plot issue.
-    df_tidy['timestamp'] = pd.to_datetime(df_tidy['timestamp'], dayfirst=True, errors='coerce')
-    df_tidy['value'] = pd.to_numeric(df_tidy['value'], errors='coerce')
-    
+    # Every cage's TIME column goes through one call, so the format is inferred once for the file.
+    raw_times = pd.concat([df_wide.iloc[:, time_positions[cage]] for cage in cage_order], ignore_index=True)
+    timestamps = pd.to_datetime(raw_times, dayfirst=True, errors='coerce').to_numpy(dtype='datetime64[ns]')
+
+    df_tidy = pd.DataFrame({
+        'animal_id': pd.Categorical.from_codes(codes, categories=categories),
+        'timestamp': timestamps,
+        'value': values,
+    })
     df_tidy.dropna(subset=['timestamp', 'value'], inplace=True)
-    
+
     # --- FIX 3: FILTER JUNK ROWS ---
     # Filter out the common zero-value artifact rows at the end of files.
     df_tidy = df_tidy[df_tidy['value'] != 0]
 
-    df_tidy = df_tidy[['animal_id', 'timestamp', 'value']]
-    df_tidy.sort_values(by=['animal_id', 'timestamp'], inplace=True)
+    # Only sort if the file broke that assumption (out-of-order rows, or two
+    # cages sharing one subject ID); checking is linear, sorting is not.
+    row_codes = df_tidy['animal_id'].cat.codes.to_numpy()
+    row_times = df_tidy['timestamp'].to_numpy()
+    same_animal = row_codes[1:] == row_codes[:-1]
+    if (row_codes[1:] < row_codes[:-1]).any() or (row_times[1:][same_animal] < row_times[:-1][same_animal]).any():
+        df_tidy = df_tidy.sort_values(by=['animal_id', 'timestamp'])
 
-    return df_tidy.reset_index(drop=True)
+    # Drop animals whose rows were all filtered out, so the categories list
+    # exactly the animals present in the data.
+    df_tidy['animal_id'] = df_tidy['animal_id'].cat.remove_unused_categories()
+
+    return df_tidy.reset_index(drop=True), None
 
 def parse_mass_data(mass_input, mass_type_name: str):
     """
@@ -242,8 +416,23 @@ def filter_data_by_time(df, time_window_option, custom_start, custom_end):
         
     return df_copy
 
-def add_light_dark_cycle_info(df, light_start, light_end):
-    """Adds a 'period' column (Light/Dark) to the dataframe."""
+def light_hours_mask(light_start, light_end):
+    """Returns a 24-entry boolean lookup table, True for each hour of the light period."""
+    mask = np.zeros(24, dtype=bool)
+    if light_start <= light_end:
+        mask[light_start:light_end] = True
+    else:
+        # The light period wraps around midnight
+        mask[light_start:] = True
+        mask[:light_end] = True
+    return mask
+
+
+def add_light_dark_cycle_info(df, light_start, light_end, light_mask=None):
+    """
+    Adds a 'period' column (Light/Dark) to the dataframe.
+    light_mask is an optional precomputed light_hours_mask(light_start, light_end).
+    """
     if not isinstance(df, pd.DataFrame) or 'timestamp' not in df.columns or df.empty:
         return df # Return original/empty df if invalid
 
@@ -253,14 +442,13 @@ def add_light_dark_cycle_info(df, light_start, light_end):
          df_copy['timestamp'] = pd.to_datetime(df_copy['timestamp'], errors='coerce')
          df_copy.dropna(subset=['timestamp'], inplace=True)
 
-    df_copy['hour'] = df_copy['timestamp'].dt.hour
+    if light_mask is None:
+        light_mask = light_hours_mask(light_start, light_end)
 
-    if light_start <= light_end:
-        df_copy['period'] = df_copy['hour'].apply(lambda h: 'Light' if light_start <= h < light_end else 'Dark')
-    else:
-        df_copy['period'] = df_copy['hour'].apply(lambda h: 'Dark' if light_end <= h < light_start else 'Light')
+    # Index the 24-hour lookup table with every row's hour instead of comparing row by row
+    hours = df_copy['timestamp'].dt.hour.to_numpy(dtype=np.intp, na_value=0)
+    df_copy['period'] = np.where(light_mask[hours], 'Light', 'Dark')
 
-    df_copy = df_copy.drop(columns=['hour'])
     return df_copy
 
 
@@ -299,7 +487,7 @@ def apply_normalization(df, mode, body_weight_map, lean_mass_map):
             error_message = "Body Weight normalization selected, but no body weight data was provided. Displaying Absolute Values."
             return df_copy, list(df_copy['animal_id'].unique()), error_message
         
-        df_copy['mass'] = df_copy['animal_id'].map(body_weight_map)
+        df_copy['mass'] = df_copy['animal_id'].map(body_weight_map).astype(float)
         mass_type = "body weight"
 
     elif mode == "Lean Mass Normalized":
@@ -307,7 +495,7 @@ def apply_normalization(df, mode, body_weight_map, lean_mass_map):
             error_message = "Lean Mass normalization selected, but no lean mass data was provided. Displaying Absolute Values."
             return df_copy, list(df_copy['animal_id'].unique()), error_message
             
-        df_copy['mass'] = df_copy['animal_id'].map(lean_mass_map)
+        df_copy['mass'] = df_copy['animal_id'].map(lean_mass_map).astype(float)
         mass_type = "lean mass"
     else:
         return df_copy, [], "Invalid normalization mode selected."
@@ -345,8 +533,8 @@ def flag_outliers(df, sd_threshold):
 
     df_copy = df.copy()
     # Use transform to calculate per-animal stats and broadcast them back to the original shape
-    animal_means = df_copy.groupby('animal_id')['value'].transform('mean')
-    animal_stds = df_copy.groupby('animal_id')['value'].transform('std')
+    animal_means = df_copy.groupby('animal_id', observed=True)['value'].transform('mean')
+    animal_stds = df_copy.groupby('animal_id', observed=True)['value'].transform('std')
     
     # Calculate the Z-score for each data point relative to its own animal's stats
     z_scores = (df_copy['value'] - animal_means) / animal_stds.fillna(1)
@@ -370,7 +558,7 @@ def calculate_summary_stats_per_animal(df):
         'is_outlier': lambda x: x.sum() # Sum of True/False gives count of outliers
     }
     
-    total_stats = df.groupby(['animal_id', 'group']).agg(agg_funcs).reset_index()
+    total_stats = df.groupby(['animal_id', 'group'], observed=True).agg(agg_funcs).reset_index()
     total_stats.rename(columns={'value': 'Total_Average', 'is_outlier': 'Outlier_Count'}, inplace=True)
     total_stats['Outlier_Count'] = total_stats['Outlier_Count'].astype(int)
 
@@ -378,7 +566,8 @@ def calculate_summary_stats_per_animal(df):
         index=['animal_id', 'group'],
         columns='period',
         values='value',
-        aggfunc='mean'
+        aggfunc='mean',
+        observed=True
     ).reset_index()
     period_avg.columns.name = None
 
@@ -447,7 +636,7 @@ def calculate_interval_data(df):
     between consecutive measurements for each animal.
     """
     df_copy = df.copy()
-    df_copy['value'] = df_copy.groupby('animal_id')['value'].diff()
+    df_copy['value'] = df_copy.groupby('animal_id', observed=True)['value'].diff()
     df_copy.dropna(subset=['value'], inplace=True)
     df_copy['value'] = df_copy['value'].clip(lower=0)
     return df_copy
\ No newline at end of file
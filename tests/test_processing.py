@@ -0,0 +1,147 @@
+# tests/test_processing.py
+
+import importlib.util
+import io
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import processing
+
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+def default_value(row, cage):
+    return f"{3000 + row + cage}.5"
+
+
+def make_clams_file(n_rows=200, cages=("0101", "0102"), subjects=("M1", "M2"), edit_row=None,
+                    value=default_value):
+    """
+    Builds a small comma-separated CLAMS export in memory. value(row_index, cage_index)
+    gives each reading's text. edit_row, if given, is called with (row_index, line)
+    and returns the line to write, so a test can corrupt individual rows.
+    """
+    lines = ["Oxymax CSV File", "Paramter,VO2 (ml/kg/hr)", ""]
+    for cage, subject in zip(cages, subjects):
+        lines += [f"Group/Cage,{cage}", f"Subject ID,{subject}"]
+    lines += [":DATA", "=======", ",".join(["INTERVAL"] + [f"CHAN,TIME,CAGE {cage}" for cage in cages])]
+
+    start = datetime(2024, 9, 13, 19, 0, 0)
+    for k in range(n_rows):
+        cells = [str(k + 1)]
+        for j in range(len(cages)):
+            timestamp = start + timedelta(minutes=13 * k, seconds=20 * j)
+            cells += [str(j + 1), timestamp.strftime("%d/%m/%Y %H:%M:%S"), value(k, j)]
+        line = ",".join(cells)
+        if edit_row is not None:
+            line = edit_row(k, line)
+        lines.append(line)
+    return "\r\n".join(lines).encode("utf-8") + b"\r\n"
+
+
+def parse(raw, engine="c"):
+    data_file = io.BytesIO(raw)
+    parameter, animal_ids, data_offset = processing.read_clams_header(data_file)
+    return processing.parse_clams_data(data_file, data_offset, animal_ids, engine=engine)
+
+
+class ParseClamsDataTests(unittest.TestCase):
+
+    def test_off_grid_timestamp_is_kept(self):
+        # One cage's clock jumps on a single row; that measured time must survive parsing
+        def jump(k, line):
+            if k != 100:
+                return line
+            cells = line.split(",")
+            cells[2] = "31/12/1999 00:00:00"
+            return ",".join(cells)
+
+        df_tidy, error = parse(make_clams_file(edit_row=jump))
+        self.assertIsNone(error)
+        self.assertEqual(len(df_tidy), 400)
+        self.assertEqual((df_tidy["timestamp"].dt.year == 1999).sum(), 1)
+
+
+class ValuePrecisionTests(unittest.TestCase):
+    """Readings must keep full float64 precision through parsing and the exports."""
+
+    def test_summary_average_matches_float64_readings(self):
+        def reading(k, j):
+            return f"{3164.8534 + (k * 37 % 100) / 100 + j:.4f}"
+
+        df_tidy, error = parse(make_clams_file(n_rows=50, value=reading))
+        self.assertIsNone(error)
+        df = processing.add_light_dark_cycle_info(df_tidy, 7, 19)
+        df = processing.flag_outliers(df, 3.0)
+        df = processing.add_group_info(df, {"A": ["M1", "M2"]})
+        summary = processing.calculate_summary_stats_per_animal(df)
+
+        expected = pd.Series([float(reading(k, 0)) for k in range(50)]).mean()
+        m1 = summary[summary["animal_id"] == "M1"].iloc[0]
+        self.assertEqual(m1["Total_Average"], expected)
+        exported = pd.read_csv(io.BytesIO(processing.convert_df_to_csv(summary)), dtype=str)
+        self.assertEqual(exported.loc[exported["animal_id"] == "M1", "Total_Average"].item(), repr(float(expected)))
+
+    def test_interval_values_match_float64_diffs(self):
+        # A cumulative feed total near 12000 g, growing by 0.13 g per interval
+        def running_total(k, j):
+            return f"{12000 + 0.13 * k + j:.2f}"
+
+        df_tidy, error = parse(make_clams_file(n_rows=30, value=running_total))
+        self.assertIsNone(error)
+        intervals = processing.calculate_interval_data(df_tidy)
+
+        totals = [float(running_total(k, 0)) for k in range(30)]
+        expected = np.diff(totals)
+        got = intervals.loc[intervals["animal_id"] == "M1", "value"].to_numpy()
+        np.testing.assert_array_equal(got, expected)
+        np.testing.assert_allclose(got, 0.13, rtol=1e-9)
+
+
+@unittest.skipUnless(HAS_PYARROW, "pyarrow is not installed")
+class ParseEngineTests(unittest.TestCase):
+
+    def assertEnginesAgree(self, raw, expected_rows):
+        df_c, error_c = parse(raw, engine="c")
+        df_arrow, error_arrow = parse(raw, engine="pyarrow")
+        self.assertIsNone(error_c)
+        self.assertIsNone(error_arrow)
+        self.assertEqual(len(df_c), expected_rows)
+        pd.testing.assert_frame_equal(df_c, df_arrow)
+
+    def test_engines_agree_on_clean_file(self):
+        self.assertEnginesAgree(make_clams_file(n_rows=30), 60)
+
+    def test_engines_agree_with_invalid_utf8_bytes(self):
+        # Stray bytes before a row's line break are ignored, not a reason to drop the row
+        raw = make_clams_file(n_rows=30).replace(b"\r\n11,", b"\xff\xfe\r\n11,")
+        self.assertEnginesAgree(raw, 60)
+
+    def test_engines_agree_with_short_trailing_row(self):
+        # The last row was cut off after the first cage: its M1 reading must survive
+        def truncate_last(k, line):
+            return ",".join(line.split(",")[:4]) if k == 29 else line
+
+        raw = make_clams_file(n_rows=30, edit_row=truncate_last)
+        self.assertEnginesAgree(raw, 59)
+        df_arrow, _ = parse(raw, engine="pyarrow")
+        self.assertEqual((df_arrow["animal_id"] == "M1").sum(), 30)
+
+    def test_engines_agree_with_junk_trailer(self):
+        # Short non-data lines after the table are dropped by both parsers
+        raw = make_clams_file(n_rows=30) + b"EVENT LOG\r\n,,\r\n"
+        self.assertEnginesAgree(raw, 60)
+
+    def test_utf8_check_keeps_stream_position(self):
+        data_file = io.BytesIO(b"abc\xff")
+        data_file.seek(1)
+        self.assertFalse(processing._is_utf8(data_file))
+        self.assertEqual(data_file.tell(), 1)
+        self.assertTrue(processing._is_utf8(io.BytesIO(b"caf\xc3\xa9")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# tests/test_validation_utils.py
+
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import validation_utils
+
+
+def reference_validation_template(df):
+    """The original single-call to_csv export; the chunked writer must match it byte for byte."""
+    if df.empty or not all(col in df.columns for col in ["animal_id", "group", "period", "value"]):
+        validation_df = pd.DataFrame(columns=["Animal_ID", "Group", "Period", "Value"])
+    else:
+        validation_df = df[["animal_id", "group", "period", "value", "is_outlier"]].copy()
+    validation_df.rename(
+        columns={
+            "animal_id": "Animal_ID",
+            "group": "Group",
+            "period": "Period",
+            "value": "Value",
+            "is_outlier": "Is_Outlier",
+        },
+        inplace=True,
+    )
+    return validation_df.to_csv(index=False).encode("utf-8")
+
+
+def make_processed_df(n_rows=25):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "animal_id": pd.Categorical(rng.choice(["M1", "M2", "F 3"], n_rows)),
+        "timestamp": pd.date_range("2024-09-13 19:00", periods=n_rows, freq="13min"),
+        "value": np.round(rng.uniform(2000, 4000, n_rows), 2).astype(np.float32),
+        "is_outlier": rng.random(n_rows) > 0.8,
+        "period": rng.choice(["Light", "Dark"], n_rows).astype(object),
+        "group": rng.choice(["A, B", 'Q "x"', "Unassigned"], n_rows).astype(object),
+    })
+
+
+class ValidationTemplateTests(unittest.TestCase):
+
+    def assertMatchesReference(self, df):
+        self.assertEqual(
+            validation_utils.generate_manual_validation_template(df),
+            reference_validation_template(df),
+        )
+
+    def test_matches_original_output(self):
+        self.assertMatchesReference(make_processed_df())
+
+    def test_matches_original_output_across_chunks(self):
+        df = make_processed_df(n_rows=25)
+        df.loc[3, "value"] = np.nan
+        with mock.patch.object(validation_utils, "_CHUNK_ROWS", 7):
+            self.assertMatchesReference(df)
+
+    def test_matches_original_output_for_bad_input(self):
+        self.assertMatchesReference(pd.DataFrame())
+        self.assertMatchesReference(make_processed_df().drop(columns=["period"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,53 +2,98 @@
 
 import streamlit as st
 import pandas as pd
+import hashlib
+import gc
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import processing
 
+@st.cache_data(show_spinner=False, max_entries=64, ttl=24 * 3600)
+def _parse_one_file(file_name, file_size, content_hash, _file):
+    """
+    Parses a single uploaded file. Cached across Streamlit reruns; the cache key is
+    the file's name, size and a hash of its full contents (the file object itself
+    is not hashed).
+
+    Returns:
+        tuple: (parameter, df_tidy, error_message). parameter is None for files
+               that are not CLAMS data files and should be skipped silently.
+    """
+    try:
+        # Step 1: Attempt to parse the header.
+        parameter, animal_ids_map, data_offset = processing.read_clams_header(_file)
+    except Exception as e:
+        # This is a file-read error, worth mentioning.
+        return None, None, f"could not be read: {e}"
+
+    if data_offset == -1:
+        return None, None, None
+
+    # If it has :DATA but no parameter, it's malformed.
+    if parameter is None:
+        return None, None, "has a ':DATA' marker but no 'Paramter' line was found"
+
+    # If we got this far, the header is valid. Now parse data table.
+    # pyarrow's multithreaded reader is used when installed; parse_clams_data re-reads the file
+    # with the C parser when pyarrow is missing or would read it differently (see its docstring).
+    df_tidy, data_error = processing.parse_clams_data(_file, data_offset, animal_ids_map, engine='pyarrow')
+
+    if df_tidy is None or df_tidy.empty:
+        # This file had a valid header but its data section failed to parse. This is a legitimate issue
+        reason = "header was OK, but data table could not be parsed"
+        return None, None, f"{reason}: {data_error}" if data_error else reason
+
+    return parameter, df_tidy, None
+
+
+def _parse_uploaded_file(file):
+    """Hashes an UploadedFile's contents and parses it through the cache."""
+    content_hash = hashlib.blake2b(file.getbuffer(), digest_size=16).hexdigest()
+    return _parse_one_file(file.name, file.size, content_hash, file)
+
+
 def load_and_parse_files(uploaded_files):
     """
     Parses all uploaded files. Silently ignores non-data files and reports
     on files that look like data but fail to parse.
     """
     parsed_data = {}
-    param_options = []
+    param_options = set()
     all_animal_ids = set()
     files_with_parsing_errors = [] 
 
-    for file in uploaded_files:
-        try:
-            # First-pass filter: Only attempt to read CSV files.
-            if not file.name.lower().endswith('.csv'):
-                continue # Silently skip non-csv files like .PDTA, .ELOG, etc.
-
-            file_content = file.getvalue().decode('utf-8', errors='ignore')
-            lines = file_content.splitlines()
-        except Exception as e:
-            # This is a file-read error, worth mentioning.
-            files_with_parsing_errors.append(f"{file.name} (could not be read: {e})")
-            continue
+    # First-pass filter: Only attempt to read CSV files.
+    # Silently skip non-csv files like .PDTA, .ELOG, etc.
+    csv_files = [file for file in uploaded_files if file.name.lower().endswith('.csv')]
 
-        # Step 1: Attempt to parse the header.
-        parameter, animal_ids_map, data_start_line = processing.parse_clams_header(lines)
+    # Files are independent and the CSV parsing runs in GIL-releasing C code, so
+    # parse them concurrently. No Streamlit calls happen inside the workers.
+    results = [None] * len(csv_files)
+    if csv_files:
+        with ThreadPoolExecutor(max_workers=min(8, len(csv_files))) as executor:
+            futures = {executor.submit(_parse_uploaded_file, file): i for i, file in enumerate(csv_files)}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    # One broken file should not take down the whole upload
+                    results[futures[future]] = (None, None, f"could not be parsed: {e}")
+        # Intermediate wide frames can sit in reference cycles; free them before the merge on big uploads
+        if len(csv_files) > 4:
+            gc.collect()
 
-        if data_start_line == -1:
+    # Merge in upload order so the outcome does not depend on which thread finished first
+    for file, (parameter, df_tidy, error_message) in zip(csv_files, results):
+        if error_message:
+            files_with_parsing_errors.append(f"{file.name} ({error_message})")
             continue
-
-        # If it has :DATA but no parameter, it's malformed.
         if parameter is None:
-            files_with_parsing_errors.append(f"{file.name} (has a ':DATA' marker but no 'Paramter' line was found)")
             continue
-        
-        # If we got this far, the header is valid. Now parse data table.
-        df_tidy = processing.parse_clams_data(lines, data_start_line, animal_ids_map)
-        
-        if df_tidy is not None and not df_tidy.empty:
-            if parameter not in param_options:
-                param_options.append(parameter)
-            parsed_data[parameter] = df_tidy
-            all_animal_ids.update(df_tidy['animal_id'].unique())
-        else:
-            # This file had a valid header but its data section failed to parse. This is a legitimate issue
-            files_with_parsing_errors.append(f"{file.name} (header was OK, but data table could not be parsed)")
+
+        param_options.add(parameter)
+        parsed_data[parameter] = df_tidy
+        # parse_clams_data returns animal_id as a categorical pruned to the animals present,
+        # so its categories already are the unique IDs; no need to scan every row
+        all_animal_ids.update(df_tidy['animal_id'].cat.categories)
 
     if files_with_parsing_errors:
         st.warning(
@@ -112,10 +157,16 @@ def render_analysis_controls(param_options):
     light_end = st.slider("Light Cycle END Hour", 0, 23, 19, key="light_end")
     st.caption(f"Current setting: Light period is from {light_start}:00 to {light_end}:00.")
 
+    # Only rebuild the hour lookup table when the cycle actually changes
+    if st.session_state.get('_light_mask_key') != (light_start, light_end):
+        st.session_state._light_mask = processing.light_hours_mask(light_start, light_end)
+        st.session_state._light_mask_key = (light_start, light_end)
+
     return {
         "selected_parameter": selected_parameter, "time_window_option": time_window_option,
         "custom_start": custom_start, "custom_end": custom_end,
         "light_start": light_start, "light_end": light_end,
+        "light_mask": st.session_state._light_mask,
     }
 
 def render_main_view():
@@ -156,40 +207,70 @@ def _update_group_assignments_callback():
     Callback function to read all group UI widgets and update session_state.
     This is the core of the new reactive logic.
     """
-    num_groups = st.session_state.get('num_groups', 1)
+    ss = st.session_state
+    sget = ss.get
+    num_groups = sget('num_groups', 1)
     new_assignments = {}
     all_assigned_in_new_state = set()
 
     for i in range(num_groups):
         group_name_key = f"group_name_{i}"
         multiselect_key = f"ms_{i}"
-        group_name = st.session_state.get(group_name_key, f"Group {i+1}").strip()
-        selected_animals = st.session_state.get(multiselect_key, [])
+        group_name = sget(group_name_key, f"Group {i+1}").strip()
+        selected_animals = sget(multiselect_key, [])
 
         if group_name:
-            for animal in selected_animals:
-                if animal in all_assigned_in_new_state:
-                    st.warning(f"Animal '{animal}' cannot be in multiple groups. Reverting some changes.")
-                    # To prevent inconsistent state, no update
-                    return
+            if not all_assigned_in_new_state.isdisjoint(selected_animals):
+                animal = next(a for a in selected_animals if a in all_assigned_in_new_state)
+                ss._group_ui_notice = ('warning', f"Animal '{animal}' cannot be in multiple groups. Reverting some changes.")
+                # To prevent inconsistent state, no update
+                return
             
             new_assignments[group_name] = selected_animals
             all_assigned_in_new_state.update(selected_animals)
             
-    st.session_state.group_assignments = new_assignments
-    st.toast("Group assignments updated!", icon="👍")
+    # A focus change with no real edit produces the same groups; keep the old dict so cached lookups stay valid.
+    # Compare items in order: column i shows the i-th group, so a reorder is a real change.
+    if list(new_assignments.items()) != list(ss.group_assignments.items()):
+        ss.group_assignments = new_assignments
+        ss._group_ui_notice = ('toast', "Group assignments updated!")
 
 
+def _assigned_set():
+    """
+    Returns a frozenset of every animal currently assigned to a group.
+    Rebuilt only when the callback replaces st.session_state.group_assignments.
+    """
+    assignments = st.session_state.group_assignments
+    # Hold a reference to the dict we built from, so an identity check is reliable
+    if st.session_state.get('_assigned_animals_source') is not assignments:
+        st.session_state._assigned_animals_cache = frozenset(
+            animal for members in assignments.values() for animal in members
+        )
+        st.session_state._assigned_animals_source = assignments
+    return st.session_state._assigned_animals_cache
+
+
+@st.fragment
 def render_group_assignment_ui(all_animal_ids):
     """
     Renders a live, reactive UI for group assignment.
     Changes are captured instantly via callbacks, no 'Update' button needed.
+    Runs as a fragment, so editing a group only reruns this block, not the whole page.
     """
     st.subheader("Assign Animals to Experimental Groups")
     st.caption("Define your groups below. Animals not assigned to any group will be labeled 'Unassigned'.")
 
-    if 'num_groups' not in st.session_state: st.session_state.num_groups = 1
-    if 'group_assignments' not in st.session_state: st.session_state.group_assignments = {}
+    ss = st.session_state
+    if 'num_groups' not in ss: ss.num_groups = 1
+    if 'group_assignments' not in ss: ss.group_assignments = {}
+
+    # Callbacks can't draw elements during a fragment rerun, so they leave their message here
+    notice = ss.pop('_group_ui_notice', None)
+    if notice:
+        kind, message = notice
+        if kind == 'toast': st.toast(message, icon="👍")
+        else: st.warning(message)
 
     st.number_input(
         "Number of Groups",
@@ -199,22 +280,29 @@ def render_group_assignment_ui(all_animal_ids):
         on_change=_update_group_assignments_callback 
     )
 
-    num_groups = st.session_state.get('num_groups', 1)
+    num_groups = ss.get('num_groups', 1)
     cols = st.columns(num_groups)
 
-    # Get a snapshot of all animals assigned right now
-    all_assigned_animals = {animal for members in st.session_state.group_assignments.values() for animal in members}
+    # The animal list only changes on a new upload: sort it once and reuse it across reruns.
+    # The uploaded list lives in session_state, so an identity check is enough (and O(1)).
+    if ss.get('_all_animals_source') is not all_animal_ids:
+        ss._all_animals_source = all_animal_ids
+        ss._all_animals_sorted = sorted(all_animal_ids)
+        ss._all_animals_set = frozenset(all_animal_ids)
+    sorted_all_animals = ss._all_animals_sorted
+
+    # Get a snapshot of all animals assigned right now, and of those still free
+    unassigned_animals = ss._all_animals_set - _assigned_set()
+
+    assignments = ss.group_assignments
+    group_keys = tuple(assignments)
 
     for i in range(num_groups):
         with cols[i]:
             group_name_key = f"group_name_{i}"
             multiselect_key = f"ms_{i}"
             
-            current_group_name = ""
-            try:
-                current_group_name = list(st.session_state.group_assignments.keys())[i]
-            except IndexError:
-                current_group_name = f"Group {i+1}"
+            current_group_name = group_keys[i] if i < len(group_keys) else f"Group {i+1}"
             
             st.text_input(
                 "Group Name",
@@ -223,15 +311,15 @@ def render_group_assignment_ui(all_animal_ids):
                 on_change=_update_group_assignments_callback
             )
             
-            current_group_members = st.session_state.group_assignments.get(current_group_name, [])
+            current_group_members = assignments.get(current_group_name, [])
             
-            # Available animals = all animals - animals assigned to OTHER groups
-            other_assigned_animals = all_assigned_animals - set(current_group_members)
-            available_options = [aid for aid in all_animal_ids if aid not in other_assigned_animals]
+            # Available animals = unassigned animals + this group's own members, already in sorted order
+            selectable = unassigned_animals.union(current_group_members)
+            available_options = [aid for aid in sorted_all_animals if aid in selectable]
             
             st.multiselect(
                 "Select Animals",
-                options=sorted(available_options),
+                options=available_options,
                 default=current_group_members,
                 key=multiselect_key,
                 on_change=_update_group_assignments_callback
@@ -1,8 +1,18 @@
 # validation_utils.py
 
+import io
+from typing import BinaryIO
+
 import pandas as pd
 
 
+# Columns a processed frame needs before it can be exported for validation
+REQUIRED_COLUMNS = frozenset({"animal_id", "group", "period", "value"})
+
+# Rows formatted per to_csv call, so a large export never holds a full-size CSV string
+_CHUNK_ROWS = 100_000
+
+
 def generate_manual_validation_template(df: pd.DataFrame) -> bytes:
     """
     Takes a processed DataFrame and prepares it for manual validation.
@@ -18,15 +28,28 @@ def generate_manual_validation_template(df: pd.DataFrame) -> bytes:
     Returns:
         bytes: A CSV file as a UTF-8 encoded byte string.
     """
-    if df.empty or not all(
-        col in df.columns for col in ["animal_id", "group", "period", "value"]
-    ):
+    sink = io.BytesIO()
+    write_manual_validation_template(df, sink)
+    return sink.getvalue()
+
+
+def write_manual_validation_template(df: pd.DataFrame, sink: BinaryIO) -> None:
+    """
+    Writes the manual validation CSV (see generate_manual_validation_template)
+    to a writable binary file-like object, in chunks of rows.
+
+    Args:
+        df (pd.DataFrame): The processed dataframe.
+        sink (BinaryIO): Destination for the UTF-8 encoded CSV.
+    """
+    if df.empty or not REQUIRED_COLUMNS.issubset(df.columns):
         # Create an empty but correctly formatted dataframe if input is bad -
         validation_df = pd.DataFrame(columns=["Animal_ID", "Group", "Period", "Value"])
     else:
-        validation_df = df[["animal_id", "group", "period", "value", "is_outlier"]].copy()
+        validation_df = df[["animal_id", "group", "period", "value", "is_outlier"]]
 
-    validation_df.rename(
+    # rename returns a new frame (lazily, under copy-on-write), so the selection needs no .copy()
+    validation_df = validation_df.rename(
         columns={
             "animal_id": "Animal_ID",
             "group": "Group",
@@ -34,7 +57,13 @@ def generate_manual_validation_template(df: pd.DataFrame) -> bytes:
             "value": "Value",
             "is_outlier":"Is_Outlier"
         },
-        inplace=True,
     )
 
-    return validation_df.to_csv(index=False).encode("utf-8")
+    _write_csv(validation_df, sink)
+
+
+def _write_csv(df: pd.DataFrame, sink: BinaryIO) -> None:
+    """Writes a DataFrame to `sink` as UTF-8 CSV, _CHUNK_ROWS rows at a time."""
+    # An empty frame still gets one pass, for the header
+    for start in range(0, max(len(df), 1), _CHUNK_ROWS):
+        df.iloc[start:start + _CHUNK_ROWS].to_csv(sink, header=start == 0, index=False, encoding="utf-8")